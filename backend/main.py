@@ -1,26 +1,50 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import os
 import uuid
+import asyncio
+import multiprocessing
 from datetime import datetime
 import json
+import re
+import io
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 # Load environment variables from .env file
 load_dotenv()
 
-from services.document_processor import DocumentProcessor
+from services.document_processor import process_document_file, init_ocr_slots, DOCUMENT_WORKERS, OCR_PROCESSES
 from services.vector_store import VectorStore
-from services.llm_service import LLMService
+from services.llm_service import LLMService, LLM_ERROR_PREFIX
+from services.response_cache import ResponseCache
+from services.file_io import copy_upload_to_disk
 from models.document import Document, DocumentResponse
 from models.query import QueryRequest, QueryResponse
 
 # Initialize services
-document_processor = DocumentProcessor()
+# Document parsing is CPU-bound; run it in worker processes to keep the event loop free.
+# Workers come from a forkserver (spawn where that's unavailable) rather than forking this
+# process, whose executor, Chroma and tokenizer threads may hold locks mid-fork.
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+# One set of OCR slots for every worker, so concurrent scanned uploads share the cores
+PROC_POOL = ProcessPoolExecutor(
+    max_workers=DOCUMENT_WORKERS,
+    mp_context=_MP_CONTEXT,
+    initializer=init_ocr_slots,
+    initargs=(_MP_CONTEXT.BoundedSemaphore(OCR_PROCESSES),)
+)
+
+async def _process_in_pool(file_path: str, document_id: str, filename: str) -> dict:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(PROC_POOL, process_document_file, file_path, document_id, filename)
 
 # Choose retrieval backend: Chroma direct (default) or LangChain wrapper
 USE_LANGCHAIN = os.getenv("USE_LANGCHAIN", "false").lower() == "true"
@@ -37,30 +61,83 @@ else:
     retrieval_store = VectorStore()
 
 llm_service = LLMService()
+response_cache = ResponseCache()
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./data/uploads")
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+# In-memory index of saved uploads, built once at startup and kept in sync by
+# upload/delete: {document_id: {"path", "filename", "mtime", "size"}}
+DOCS: dict = {}
+
+def _register_doc(document_id: str, filename: str, file_path: str):
+    stat = os.stat(file_path)
+    DOCS[document_id] = {
+        "path": file_path,
+        "filename": filename,
+        "mtime": stat.st_mtime,
+        "size": stat.st_size
+    }
+
+def _load_docs():
+    """Populate DOCS from the upload directory (files are saved as uuid_filename)."""
+    DOCS.clear()
+    if not os.path.exists(UPLOAD_DIR):
+        return
+    for filename_on_disk in os.listdir(UPLOAD_DIR):
+        if filename_on_disk.endswith(SUPPORTED_EXTENSIONS):
+            parts = filename_on_disk.split('_', 1)
+            if len(parts) >= 2:
+                document_id, original_filename = parts
+            else:
+                document_id = original_filename = filename_on_disk
+            _register_doc(document_id, original_filename, os.path.join(UPLOAD_DIR, filename_on_disk))
 
-# Helper to (re)index a saved file on disk
-async def _index_saved_file(file_path: str, filename_on_disk: str):
+# Helper to (re)index a registered upload (DOCS id and display name). Returns (info, records) where records is
+# (chunks, metadatas, ids) ready for retrieval_store.add_many, or None.
+async def _index_saved_file(doc_id: str, original_name: str, file_path: str):
     try:
-        doc_id = filename_on_disk.split('_')[0]
-        original_name = filename_on_disk.split('_', 1)[1] if '_' in filename_on_disk else filename_on_disk
-        processed = await document_processor.process_document(
-            file_path=file_path,
-            document_id=doc_id,
-            filename=original_name
-        )
+        processed = await _process_in_pool(file_path, doc_id, original_name)
         chunks = processed.get("chunks", [])
         metadata = processed.get("metadata", [])
+        records = None
         if chunks:
-            await vector_store.add_document(document_id=doc_id, chunks=chunks, metadata=metadata)
-            print(f"Reindexed {original_name}: {len(chunks)} chunks")
+            ids, metadatas = retrieval_store.prepare_records(doc_id, chunks, metadata)
+            records = (chunks, metadatas, ids)
+            print(f"Prepared {original_name}: {len(chunks)} chunks")
         else:
             print(f"No extractable text for {original_name}; skipped indexing")
-        return {"document_id": doc_id, "filename": original_name, "chunks": len(chunks)}
+        return {"document_id": doc_id, "filename": original_name, "chunks": len(chunks)}, records
     except Exception as e:
-        print(f"Failed to index {filename_on_disk}: {str(e)}")
-        return {"document_id": None, "filename": filename_on_disk, "error": str(e)}
+        print(f"Failed to index {original_name}: {str(e)}")
+        return {"document_id": None, "filename": original_name, "error": str(e)}, None
+
+# Processed documents keyed by (path, mtime, size), so a replaced file misses naturally
+_PROCESSED_CACHE_SIZE = 256
+_processed_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+
+async def _get_processed(document_id: str, entry: dict) -> dict:
+    """Return DocumentProcessor output for a DOCS entry, parsing it at most once per file version."""
+    key = (entry["path"], entry["mtime"], entry["size"])
+    cached = _processed_cache.get(key)
+    if cached is not None:
+        _processed_cache.move_to_end(key)
+        return cached
+    processed = await _process_in_pool(entry["path"], document_id, entry["filename"])
+    _processed_cache[key] = processed
+    if len(_processed_cache) > _PROCESSED_CACHE_SIZE:
+        _processed_cache.popitem(last=False)
+    return processed
+
+def _evict_processed(file_path: str):
+    for key in [k for k in _processed_cache if k[0] == file_path]:
+        del _processed_cache[key]
 
 # --- Presentation helpers ----------------------------------------------------
+_LIST_RE = re.compile(r"^\s*[-*]\s+")
+_LETTERS_RE = re.compile(r"[^A-Za-z]")
+_STRIP_ASTERISKS = str.maketrans("", "", "*")
+
 def _bold_headings_and_clean(text: str) -> str:
     """Make headings bold, remove asterisks, and normalize bullets.
     Heuristics:
@@ -68,38 +145,31 @@ def _bold_headings_and_clean(text: str) -> str:
     - Replace leading '- ' or '* ' with '• '.
     - Strip stray '*'.
     """
-    import re
-    lines = text.splitlines()
-    out = []
-    for line in lines:
-        # Normalize list markers
-        line = re.sub(r"^\s*[-*]\s+", "• ", line)
-        # Remove stray asterisks anywhere
-        line = line.replace("*", "")
-        # Bold headings (UPPERCASE and ending with ':')
-        stripped = line.strip()
-        if stripped.endswith(":"):
-            # Count uppercase proportion
-            letters = re.sub(r"[^A-Za-z]", "", stripped[:-1])
-            upper = sum(1 for c in letters if c.isupper())
-            if letters and upper / max(1, len(letters)) > 0.6:
-                line = f"**{stripped}**"
-        out.append(line)
-    return "\n".join(out).strip()
+    return "\n".join(_clean_line(line) for line in text.splitlines()).strip()
+
+def _clean_line(line: str) -> str:
+    """Apply the _bold_headings_and_clean heuristics to a single line."""
+    # Normalize list markers
+    line = _LIST_RE.sub("• ", line)
+    # Remove stray asterisks anywhere
+    line = line.translate(_STRIP_ASTERISKS)
+    # Bold headings (UPPERCASE and ending with ':')
+    stripped = line.strip()
+    if stripped.endswith(":"):
+        # Count uppercase proportion
+        letters = _LETTERS_RE.sub("", stripped[:-1])
+        upper = sum(1 for c in letters if c.isupper())
+        if letters and upper / max(1, len(letters)) > 0.6:
+            line = f"**{stripped}**"
+    return line
 
 def _format_references(citations: list, single_doc: bool) -> str:
-    # Deduplicate while preserving order
-    seen = set()
-    items = []
-    for c in citations or []:
-        key = (c.get("filename"), str(c.get("page")))
-        if key not in seen:
-            seen.add(key)
-            items.append(key)
+    items = _dedupe_citations(citations or [])
     if not items:
         return ""
     lines = ["", "**REFERENCES:**"]
-    for filename, page in items:
+    for c in items:
+        filename, page = c.get("filename"), c.get("page")
         if single_doc:
             lines.append(f"• Page {page}")
         else:
@@ -115,30 +185,55 @@ def _add_inline_citations(text: str, citations: list, single_doc: bool):
         return text, []
     lines = text.splitlines()
     out = []
-    used = []
+    used = {}
     idx = 0
     for line in lines:
-        stripped = line.strip()
-        is_heading = stripped.endswith(":") or (stripped.startswith("**") and stripped.endswith("**") and stripped[:-2].endswith(":"))
-        if stripped and not is_heading:
-            c = citations[idx % len(citations)]
-            filename = c.get("filename", "")
-            page = c.get("page", "?")
-            cite = f"(p. {page})" if single_doc else f"({filename}, p. {page})"
-            if not stripped.endswith(")"):
-                line = f"{line} {cite}"
-                used.append({"filename": filename, "page": page})
-            idx += 1
+        line, idx, cited = _cite_line(line, citations, idx, single_doc)
+        if cited:
+            _add_citation(used, cited)
         out.append(line)
-    # Deduplicate used citations while preserving order
-    seen = set()
-    dedup_used = []
-    for u in used:
-        key = (u.get("filename"), str(u.get("page")))
-        if key not in seen:
-            seen.add(key)
-            dedup_used.append(u)
-    return "\n".join(out), dedup_used
+    return "\n".join(out), list(used.values())
+
+def _add_citation(unique: dict, citation: dict):
+    """Record citation in an insertion-ordered dict keyed by (filename, page); first one wins."""
+    unique.setdefault((citation.get("filename"), str(citation.get("page"))), citation)
+
+def _dedupe_citations(citations: list) -> list:
+    """Deduplicate citations by (filename, page) while preserving order."""
+    unique = {}
+    for c in citations:
+        _add_citation(unique, c)
+    return list(unique.values())
+
+def _cite_line(line: str, citations: list, idx: int, single_doc: bool):
+    """Cite one line with the next rotating citation; return (line, next_idx, used_citation_or_None)."""
+    stripped = line.strip()
+    is_heading = stripped.endswith(":") or (stripped.startswith("**") and stripped.endswith("**") and stripped[:-2].endswith(":"))
+    if not stripped or is_heading:
+        return line, idx, None
+    c = citations[idx % len(citations)]
+    filename = c.get("filename", "")
+    page = c.get("page", "?")
+    cited = None
+    if not stripped.endswith(")"):
+        cite = f"(p. {page})" if single_doc else f"({filename}, p. {page})"
+        line = f"{line} {cite}"
+        cited = {"filename": filename, "page": page}
+    return line, idx + 1, cited
+
+def _cited_filename(line: str):
+    """Return the filename of a trailing '(filename, p. N)' citation, or None."""
+    line = line.rstrip()
+    # Most lines don't end in a citation; bail out before any parsing
+    if not line.endswith(")"):
+        return None
+    head, sep, page = line[:-1].rpartition(", p. ")
+    if not sep or not page.isdecimal():
+        return None
+    open_idx = head.find("(")
+    if open_idx < 0 or open_idx == len(head) - 1:
+        return None
+    return head[open_idx + 1:]
 
 def _add_section_gaps(text: str, single_doc: bool) -> str:
     """Insert a blank line when the inline citation's filename changes between lines.
@@ -146,14 +241,11 @@ def _add_section_gaps(text: str, single_doc: bool) -> str:
     """
     if single_doc:
         return text
-    import re
-    pattern = re.compile(r"\((?P<filename>.+?), p\. \d+\)\s*$")
     lines = text.splitlines()
     out = []
     prev_file = None
     for line in lines:
-        m = pattern.search(line)
-        curr_file = m.group('filename') if m else None
+        curr_file = _cited_filename(line)
         if prev_file is not None and curr_file is not None and curr_file != prev_file:
             # Insert a visual gap between summaries
             if out and out[-1] != "":
@@ -163,18 +255,97 @@ def _add_section_gaps(text: str, single_doc: bool) -> str:
             prev_file = curr_file
     return "\n".join(out)
 
+def _postprocess(text: str, citations: list, single_doc: bool, section_gaps: bool = False):
+    """Format an LLM answer in a single pass over its lines and return (text, used_citations).
+    Equivalent to _bold_headings_and_clean, then _add_inline_citations, then (when
+    section_gaps is set) _add_section_gaps.
+    """
+    out = []
+    used = {}
+    idx = 0
+    prev_file = None
+    for line in text.strip().splitlines():
+        line = _clean_line(line)
+        if citations:
+            line, idx, cited = _cite_line(line, citations, idx, single_doc)
+            if cited:
+                _add_citation(used, cited)
+        if section_gaps and not single_doc:
+            curr_file = _cited_filename(line)
+            if prev_file is not None and curr_file is not None and curr_file != prev_file:
+                # Insert a visual gap between summaries
+                if out and out[-1] != "":
+                    out.append("")
+            if curr_file:
+                prev_file = curr_file
+        out.append(line)
+    return "\n".join(out).strip(), list(used.values())
+
+def _build_context(citations: list, texts: list) -> str:
+    """Join chunk texts under their [Source: file, page N] markers, writing into one buffer."""
+    buf = io.StringIO()
+    for i, (citation, text) in enumerate(zip(citations, texts)):
+        if i:
+            buf.write("\n\n")
+        buf.write("[Source: ")
+        buf.write(str(citation["filename"]))
+        buf.write(", page ")
+        buf.write(str(citation["page"]))
+        buf.write("]\n")
+        buf.write(text)
+    return buf.getvalue()
+
+# Bound on concurrent LLM calls when summarizing several documents at once
+_llm_semaphore = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "4")))
+
+async def _summarize_doc(query: str, doc_id: str, hits: list):
+    """Answer the query from one document's hits and return (heading, text, used_citations)."""
+    # Compose context and citations for this doc
+    per_citations = []
+    texts = []
+    doc_display = None
+    for item in hits:
+        meta = item.get("metadata", {})
+        filename = meta.get("filename", f"Document {doc_id}")
+        if not doc_display:
+            doc_display = filename
+        page = meta.get("page", "?")
+        per_citations.append({"filename": filename, "page": page})
+        texts.append(item.get("text", ""))
+    context = _build_context(per_citations, texts)
+
+    # Generate response per doc
+    content_chunks = []
+    async with _llm_semaphore:
+        async for chunk in llm_service.generate_response(
+            query=query,
+            context=context,
+            citations=per_citations
+        ):
+            content_chunks.append(chunk)
+    # Multi-doc mode: include filename in inline citations
+    doc_answer, used = _postprocess("".join(content_chunks), per_citations, single_doc=False, section_gaps=True)
+    # Add a clear heading per document
+    heading = f"**{(doc_display or doc_id)}:**"
+    return heading, doc_answer, used
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("Initializing retrieval store (LangChain=" + str(USE_LANGCHAIN) + ")...")
     await retrieval_store.initialize()
     print("Retrieval store initialized successfully")
+    _load_docs()
+    print(f"Loaded {len(DOCS)} uploaded document(s)")
     yield
     # Shutdown
     print("Shutting down...")
+    await retrieval_store.flush()
+    PROC_POOL.shutdown(cancel_futures=True)
 
 # Create FastAPI app with lifespan
-app = FastAPI(title="Docology API", version="1.0.0", lifespan=lifespan)
+# orjson serializes the nested citation/document payloads faster and handles datetimes natively
+app = FastAPI(title="Docology API", version="1.0.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -205,31 +376,26 @@ async def upload_document(file: UploadFile = File(...)):
         document_id = str(uuid.uuid4())
         
         # Save uploaded file
-        upload_dir = "./data/uploads"
-        os.makedirs(upload_dir, exist_ok=True)
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
         
         # Simple filename handling
         safe_filename = file.filename.replace(" ", "_").replace("/", "_")
-        file_path = os.path.join(upload_dir, f"{document_id}_{safe_filename}")
+        file_path = os.path.join(UPLOAD_DIR, f"{document_id}_{safe_filename}")
         
         print(f"Saving to: {file_path}")
         
-        # Read and save file
-        content = await file.read()
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
+        # Copy the upload to disk without blocking the event loop
+        size = await copy_upload_to_disk(file, file_path)
         
-        print(f"File saved! Size: {len(content)} bytes")
+        print(f"File saved! Size: {size} bytes")
+        _register_doc(document_id, safe_filename, file_path)
+        response_cache.invalidate(document_id)
 
         pages = 1
         indexing_warning = None
         try:
             # Process the document into chunks and index into the vector store
-            processed = await document_processor.process_document(
-                file_path=file_path,
-                document_id=document_id,
-                filename=file.filename
-            )
+            processed = await _process_in_pool(file_path, document_id, file.filename)
             pages = processed.get("pages", 1)
             chunks = processed.get("chunks", [])
             metadata = processed.get("metadata", [])
@@ -254,7 +420,7 @@ async def upload_document(file: UploadFile = File(...)):
             "document_id": document_id,
             "filename": file.filename,
             "pages": pages,
-            "size": len(content),
+            "size": size,
             "message": "Document uploaded successfully"
         }
         if indexing_warning:
@@ -269,246 +435,268 @@ async def upload_document(file: UploadFile = File(...)):
         traceback.print_exc()
         return {"error": f"Upload failed: {str(e)}"}
 
-@app.post("/ask")
-async def ask_question(request: QueryRequest):
-    """Ask a question and get response"""
+def _select_docs(document_ids: Optional[List[str]]) -> List[tuple]:
+    """(document_id, entry) pairs for the selected documents, or all documents when none are selected."""
+    if document_ids:
+        return [(d, DOCS[d]) for d in document_ids if d in DOCS]
+    return list(DOCS.items())
+
+async def _render_answer(query: str, context: str, citations: list, single_doc: bool) -> dict:
+    """Generate an answer from context and format it with inline citations and references."""
+    # Generate response using the LLM service (accumulate to a single string)
+    content_chunks = []
+    async for chunk in llm_service.generate_response(
+        query=query,
+        context=context,
+        citations=citations
+    ):
+        content_chunks.append(chunk)
+    full_content = "".join(content_chunks).strip()
+    if not full_content:
+        full_content = "I don't know the answer to that question based on the provided documents."
+    # Post-process for readability and references
+    pretty, used = _postprocess(full_content, citations, single_doc)
+    refs = _format_references(used, single_doc)
+    if refs:
+        pretty = f"{pretty}\n\n{refs}"
+    return {"content": pretty, "citations": citations}
+
+async def _retrieve(query: str, query_embedding, top_k: int, document_ids: Optional[List[str]]) -> list:
+    """Vector search that reuses the request's query embedding when one was computed."""
+    if query_embedding is not None:
+        return await retrieval_store.search_by_embedding(query_embedding, top_k=top_k, document_ids=document_ids)
+    return await retrieval_store.search(query=query, top_k=top_k, document_ids=document_ids)
+
+async def _answer_context(request: QueryRequest, query_embedding=None):
+    """Build (context, citations) for a single-document or unscoped question.
+    Uses vector retrieval, falling back to on-the-fly extraction (e.g. empty index).
+    Citations are empty when nothing relevant was found.
+    """
+    # Use vector store retrieval to get top-k relevant chunks (single or no selection)
     try:
-        print(f"=== CHAT REQUEST ===")
-        print(f"Query: {request.query}")
-        print(f"Document IDs: {request.document_ids}")
-        
-        # Process documents and extract content
-        upload_dir = "./data/uploads"
-        relevant_content = []
+        retrieved = await _retrieve(request.query, query_embedding, 8, request.document_ids)
+    except Exception as e:
+        print(f"Vector search failed, falling back to raw extraction: {str(e)}")
+        retrieved = []
+
+    if retrieved:
+        # Build concise context from top chunks with source markers
         citations = []
-        
-        # Get list of files to process
-        files_to_process = []
-        if os.path.exists(upload_dir):
-            for filename in os.listdir(upload_dir):
-                if filename.endswith(('.pdf', '.docx', '.txt')):
-                    # If specific documents are selected, only process those
-                    if request.document_ids:
-                        file_id = filename.split('_')[0]
-                        print(f"Checking file: {filename}, extracted ID: {file_id}, looking for: {request.document_ids}")
-                        if file_id in request.document_ids:
-                            files_to_process.append(filename)
-                            print(f"Added to process: {filename}")
-                    else:
-                        # Process all files if no specific selection
-                        files_to_process.append(filename)
-                        print(f"Added to process (all): {filename}")
-        
-        print(f"Processing {len(files_to_process)} files...")
-        
-        # If no files found with specific IDs, process all files as fallback
-        if not files_to_process and request.document_ids:
-            print("No files found with specific IDs, processing all files as fallback...")
-            for filename in os.listdir(upload_dir):
-                if filename.endswith(('.pdf', '.docx', '.txt')):
-                    files_to_process.append(filename)
-        
-        print(f"Final files to process: {files_to_process}")
-        
-        # Process each file and extract relevant content
-        for filename in files_to_process:
-            file_path = os.path.join(upload_dir, filename)
-            
-            try:
-                # Use the document processor to handle different file types
-                document_id = filename.split('_')[0]
-                file_extension = os.path.splitext(filename)[1].lower()
-                
-                # Process the document based on its type
-                if file_extension == '.pdf':
-                    result = await document_processor._process_pdf(file_path, document_id, filename)
-                elif file_extension == '.docx':
-                    result = await document_processor._process_docx(file_path, document_id, filename)
-                elif file_extension == '.txt':
-                    result = await document_processor._process_txt(file_path, document_id, filename)
-                else:
-                    print(f"Unsupported file type: {file_extension}")
-                    continue
-                
-                # Add the processed content to our results
-                if result and 'chunks' in result and result['chunks']:
-                    # Combine chunks for this document
-                    doc_content = "\n\n".join([f"[Document: {filename}, Page {meta.get('page', '?')}]\n{chunk}" 
-                                          for chunk, meta in zip(result['chunks'], result['metadata'])])
-                    
-                    relevant_content.append({
-                        'filename': filename,
-                        'content': doc_content,
-                        'metadata': result['metadata']
-                    })
-                    
-                    # Add citation for this document
-                    citations.append({
-                        'filename': filename.split('_', 1)[1] if '_' in filename else filename,
-                        'page': 'Multiple' if len(result['metadata']) > 1 else result['metadata'][0].get('page', '1')
-                    })
-                    
-                    print(f"Processed {filename}: {len(doc_content)} characters")
-                
-            except Exception as e:
-                print(f"Error processing {filename}: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                continue
-        
-        # If multiple docs are selected, build a summary per doc
+        texts = []
+        for item in retrieved:
+            meta = item.get("metadata", {})
+            citations.append({"filename": meta.get("filename", "document"), "page": meta.get("page", "?")})
+            texts.append(item.get("text", ""))
+        return _build_context(citations, texts), citations
+
+    # As a fallback (e.g., empty index), try processing selected files on-the-fly (previous behavior)
+    files_to_process = _select_docs(request.document_ids)
+
+    # Only the first N chunks are used, so stop parsing files once we have them
+    max_chunks = 8
+    limited = []
+    for document_id, entry in files_to_process:
+        if len(limited) >= max_chunks:
+            break
+        filename = entry["filename"]
+        try:
+            # Reuse DocumentProcessor output, cached until the file changes
+            processed = await _get_processed(document_id, entry)
+            chunks = processed.get("chunks", [])
+            metas = processed.get("metadata", [])
+            limited.extend(zip(chunks[:max_chunks - len(limited)], metas))
+        except Exception as e:
+            print(f"Fallback processing failed for {filename}: {str(e)}")
+
+    citations = [{"filename": m.get("filename", "document"), "page": m.get("page", "?")} for _, m in limited]
+    context = _build_context(citations, [c for c, _ in limited])
+    return context, citations
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+async def _stream_answer(request: QueryRequest):
+    """Yield SSE events for /ask/stream: 'delta' events carry post-processed lines as the
+    LLM produces them, a final 'done' event carries the references block and citations.
+    """
+    try:
+        # Multi-doc answers are aggregated per document, so they are sent in one piece
         if request.document_ids and len(request.document_ids) > 1:
-            sections = []
-            all_used_citations = []
-            for doc_id in request.document_ids:
+            result = await ask_question(request)
+            yield _sse({"type": "done", **result})
+            return
+
+        query_embedding = await _query_embedding(request.query)
+        if query_embedding is not None:
+            cached = response_cache.get(request.document_ids, query_embedding)
+            if cached:
+                print("Answer served from response cache")
+                yield _sse({"type": "delta", "content": cached["content"]})
+                yield _sse({"type": "done", "references": "", "citations": cached["citations"]})
+                return
+
+        context, citations = await _answer_context(request, query_embedding)
+        if not citations:
+            yield _sse({"type": "done", "content": "No relevant documents found to answer your question.", "citations": []})
+            return
+
+        single_doc = bool(request.document_ids and len(request.document_ids) == 1)
+        used = {}
+        idx = 0
+        buffer = ""
+        started = False
+        streamed = []
+
+        def render(lines):
+            nonlocal idx
+            out = []
+            for line in lines:
+                line = _clean_line(line)
+                line, idx, cited = _cite_line(line, citations, idx, single_doc)
+                if cited:
+                    _add_citation(used, cited)
+                out.append(line)
+            return "\n".join(out)
+
+        # Post-process on a rolling buffer: only complete lines are emitted
+        async for chunk in llm_service.generate_response(
+            query=request.query,
+            context=context,
+            citations=citations
+        ):
+            buffer += chunk
+            if "\n" not in buffer:
+                continue
+            complete, buffer = buffer.rsplit("\n", 1)
+            text = render(complete.split("\n"))
+            if not started:
+                text = text.lstrip()
+            if text:
+                started = True
+                streamed.append(text + "\n")
+                yield _sse({"type": "delta", "content": text + "\n"})
+
+        if buffer.strip():
+            text = render([buffer])
+            streamed.append(text if started else text.lstrip())
+            yield _sse({"type": "delta", "content": streamed[-1]})
+        elif not started:
+            streamed.append("I don't know the answer to that question based on the provided documents.")
+            yield _sse({"type": "delta", "content": streamed[-1]})
+
+        refs = _format_references(list(used.values()), single_doc)
+        yield _sse({"type": "done", "references": refs, "citations": citations})
+
+        content = "".join(streamed).strip()
+        if refs:
+            content = f"{content}\n\n{refs}"
+        result = {"content": content, "citations": citations}
+        if query_embedding is not None and _cacheable(result):
+            response_cache.put(request.document_ids, query_embedding, content, citations)
+    except Exception as e:
+        print(f"Error in stream_answer: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        yield _sse({
+            "type": "error",
+            "content": f"An error occurred while processing your request: {str(e)}",
+            "citations": []
+        })
+
+async def _query_embedding(query: str):
+    try:
+        return await retrieval_store.embed(query)
+    except Exception as e:
+        print(f"Query embedding failed, skipping response cache and embedding reuse: {str(e)}")
+        return None
+
+def _cacheable(result: dict) -> bool:
+    # Don't cache "nothing found" answers or LLM failures
+    return bool(result.get("citations")) and LLM_ERROR_PREFIX not in result.get("content", "")
+
+async def _answer_question(request: QueryRequest, query_embedding=None) -> dict:
+    """Retrieve, generate and format the answer for /ask (no caching).
+    query_embedding, when given, is reused for every vector search instead of re-embedding the query.
+    """
+    # If multiple docs are selected, build a summary per doc
+    if request.document_ids and len(request.document_ids) > 1:
+        sections = []
+        all_used_citations = {}
+        per_doc_top_k = 6
+        # One query across all selected docs, then bucket hits per doc (already ranked by distance)
+        buckets = {}
+        search_top_k = per_doc_top_k * len(request.document_ids)
+        try:
+            hits = await _retrieve(request.query, query_embedding, search_top_k, request.document_ids)
+        except Exception as e:
+            print(f"Vector search failed for {request.document_ids}: {str(e)}")
+            hits = []
+        for item in hits:
+            doc_id = (item.get("metadata") or {}).get("document_id")
+            bucket = buckets.setdefault(doc_id, [])
+            if len(bucket) < per_doc_top_k:
+                bucket.append(item)
+
+        # A full result may have been crowded out by one document's chunks, so re-query the
+        # underfilled documents on their own (concurrently) to give each up to per_doc_top_k hits
+        if len(hits) >= search_top_k:
+            underfilled = [d for d in request.document_ids if len(buckets.get(d, [])) < per_doc_top_k]
+
+            async def _refill(doc_id: str):
                 try:
-                    per_doc = await retrieval_store.search(
-                        query=request.query,
-                        top_k=6,
-                        document_ids=[doc_id]
-                    )
+                    return doc_id, await _retrieve(request.query, query_embedding, per_doc_top_k, [doc_id])
                 except Exception as e:
                     print(f"Vector search failed for {doc_id}: {str(e)}")
-                    per_doc = []
-
-                if not per_doc:
-                    continue
-
-                # Compose context and citations for this doc
-                per_citations = []
-                parts = []
-                doc_display = None
-                for item in per_doc:
-                    meta = item.get("metadata", {})
-                    filename = meta.get("filename", f"Document {doc_id}")
-                    if not doc_display:
-                        doc_display = filename
-                    page = meta.get("page", "?")
-                    per_citations.append({"filename": filename, "page": page})
-                    parts.append(f"[Source: {filename}, page {page}]\n{item.get('text', '')}")
-                context = "\n\n".join(parts)
-
-                # Generate response per doc
-                content_chunks = []
-                async for chunk in llm_service.generate_response(
-                    query=request.query,
-                    context=context,
-                    citations=per_citations
-                ):
-                    content_chunks.append(chunk)
-                doc_answer = "".join(content_chunks).strip()
-                doc_answer = _bold_headings_and_clean(doc_answer)
-                # Multi-doc mode: include filename in inline citations
-                doc_answer, used = _add_inline_citations(doc_answer, per_citations, single_doc=False)
-                all_used_citations.extend(used)
-                # Add a clear heading per document
-                heading = f"**{(doc_display or doc_id)}:**"
-                sections.append(f"{heading}\n{doc_answer}")
-
-            if sections:
-                final_text = "\n\n".join(sections)
-                # Add gaps for readability across documents (no-op for single_doc=False handled already by separation)
-                final_text = _add_section_gaps(final_text, single_doc=False)
-                refs = _format_references(all_used_citations, single_doc=False)
-                if refs:
-                    final_text = f"{final_text}\n\n{refs}"
-                return {"content": final_text, "citations": all_used_citations or []}
-
-        # Use vector store retrieval to get top-k relevant chunks (single or no selection)
-        try:
-            retrieved = await retrieval_store.search(
-                query=request.query,
-                top_k=8,
-                document_ids=request.document_ids
-            )
-        except Exception as e:
-            print(f"Vector search failed, falling back to raw extraction: {str(e)}")
-            retrieved = []
-
-        if retrieved:
-            # Build concise context from top chunks with source markers
-            citations = []
-            context_parts = []
-            for item in retrieved:
-                meta = item.get("metadata", {})
-                text = item.get("text", "")
-                filename = meta.get("filename", "document")
-                page = meta.get("page", "?")
-                citations.append({"filename": filename, "page": page})
-                context_parts.append(f"[Source: {filename}, page {page}]\n{text}")
-            context = "\n\n".join(context_parts)
-
-            # Generate response using the LLM service (accumulate to a single string)
-            content_chunks = []
-            async for chunk in llm_service.generate_response(
-                query=request.query,
-                context=context,
-                citations=citations
-            ):
-                content_chunks.append(chunk)
-            full_content = "".join(content_chunks).strip()
-            if not full_content:
-                full_content = "I don't know the answer to that question based on the provided documents."
-            # Post-process for readability and references
-            single_doc = bool(request.document_ids and len(request.document_ids) == 1)
-            pretty = _bold_headings_and_clean(full_content)
-            pretty, used = _add_inline_citations(pretty, citations, single_doc)
-            refs = _format_references(used, single_doc)
+                    return doc_id, buckets.get(doc_id, [])
+
+            for doc_id, doc_hits in await asyncio.gather(*[_refill(d) for d in underfilled]):
+                buckets[doc_id] = doc_hits
+
+        # Generate all per-doc summaries concurrently; gather keeps the selection order
+        results = await asyncio.gather(*[
+            _summarize_doc(request.query, doc_id, buckets[doc_id])
+            for doc_id in request.document_ids if buckets.get(doc_id)
+        ])
+        for heading, doc_answer, used in results:
+            for cited in used:
+                _add_citation(all_used_citations, cited)
+            sections.append(f"{heading}\n{doc_answer}")
+
+        if sections:
+            final_text = "\n\n".join(sections)
+            citations = list(all_used_citations.values())
+            refs = _format_references(citations, single_doc=False)
             if refs:
-                pretty = f"{pretty}\n\n{refs}"
+                final_text = f"{final_text}\n\n{refs}"
+            return {"content": final_text, "citations": citations}
+
+    context, citations = await _answer_context(request, query_embedding)
+    if not citations:
+        return {"content": "No relevant documents found to answer your question.", "citations": []}
+
+    single_doc = bool(request.document_ids and len(request.document_ids) == 1)
+    return await _render_answer(request.query, context, citations, single_doc)
+
+@app.post("/ask")
+async def ask_question(request: QueryRequest):
+    """Ask a question and get response"""
+    try:
+        print(f"=== CHAT REQUEST ===")
+        print(f"Query: {request.query}")
+        print(f"Document IDs: {request.document_ids}")
+
+        query_embedding = await _query_embedding(request.query)
+        if query_embedding is not None:
+            cached = response_cache.get(request.document_ids, query_embedding)
+            if cached:
+                print("Answer served from response cache")
+                return cached
+
+        result = await _answer_question(request, query_embedding)
+        if query_embedding is not None and _cacheable(result):
+            response_cache.put(request.document_ids, query_embedding, result["content"], result["citations"])
+        return result
 
-            return {"content": pretty, "citations": citations}
-        else:
-            # As a fallback (e.g., empty index), try processing selected files on-the-fly (previous behavior)
-            upload_dir = "./data/uploads"
-            files_to_process = []
-            if os.path.exists(upload_dir):
-                for filename in os.listdir(upload_dir):
-                    if filename.endswith((".pdf", ".docx", ".txt")):
-                        if request.document_ids:
-                            file_id = filename.split('_')[0]
-                            if file_id in request.document_ids:
-                                files_to_process.append(filename)
-                        else:
-                            files_to_process.append(filename)
-
-            relevant_content = []
-            for filename in files_to_process:
-                file_path = os.path.join(upload_dir, filename)
-                try:
-                    # Reuse DocumentProcessor to extract text quickly
-                    doc_id = filename.split('_')[0]
-                    processed = await document_processor.process_document(file_path, doc_id, filename)
-                    chunks = processed.get("chunks", [])
-                    metas = processed.get("metadata", [])
-                    for chunk, meta in zip(chunks, metas):
-                        relevant_content.append((chunk, meta))
-                except Exception as e:
-                    print(f"Fallback processing failed for {filename}: {str(e)}")
-
-            if relevant_content:
-                # Limit to first N chunks
-                limited = relevant_content[:8]
-                citations = [{"filename": m.get("filename", "document"), "page": m.get("page", "?")} for _, m in limited]
-                context = "\n\n".join([f"[Source: {m.get('filename')}, page {m.get('page')}]\n{c}" for c, m in limited])
-                content_chunks = []
-                async for chunk in llm_service.generate_response(
-                    query=request.query,
-                    context=context,
-                    citations=citations
-                ):
-                    content_chunks.append(chunk)
-                full_content = "".join(content_chunks).strip()
-                single_doc = bool(request.document_ids and len(request.document_ids) == 1)
-                pretty = _bold_headings_and_clean(full_content)
-                pretty, used = _add_inline_citations(pretty, citations, single_doc)
-                refs = _format_references(used, single_doc)
-                if refs:
-                    pretty = f"{pretty}\n\n{refs}"
-                return {"content": pretty, "citations": citations}
-            else:
-                return {"content": "No relevant documents found to answer your question.", "citations": []}
-            
     except Exception as e:
         print(f"Error in ask_question: {str(e)}")
         import traceback
@@ -518,38 +706,30 @@ async def ask_question(request: QueryRequest):
             "citations": []
         }
 
+@app.post("/ask/stream")
+async def ask_question_stream(request: QueryRequest):
+    """Ask a question and stream the response as server-sent events"""
+    print(f"=== CHAT STREAM REQUEST ===")
+    print(f"Query: {request.query}")
+    print(f"Document IDs: {request.document_ids}")
+    return StreamingResponse(_stream_answer(request), media_type="text/event-stream")
+
 @app.get("/documents")
 async def list_documents():
     """List all uploaded documents"""
     try:
-        # Get all files from upload directory
-        upload_dir = "./data/uploads"
         documents = []
-        
-        if os.path.exists(upload_dir):
-            for filename in os.listdir(upload_dir):
-                if filename.endswith(('.pdf', '.docx', '.txt')):
-                    file_path = os.path.join(upload_dir, filename)
-                    file_stat = os.stat(file_path)
-                    
-                    # Extract document_id from filename (format: uuid_filename)
-                    parts = filename.split('_', 1)
-                    if len(parts) >= 2:
-                        document_id = parts[0]
-                        original_filename = parts[1]
-                    else:
-                        document_id = filename
-                        original_filename = filename
-                    
-                    documents.append({
-                        "id": document_id,
-                        "document_id": document_id,
-                        "filename": original_filename,
-                        "upload_date": datetime.fromtimestamp(file_stat.st_mtime).isoformat(),
-                        "created_at": datetime.fromtimestamp(file_stat.st_mtime).isoformat(),
-                        "pages": 1,  # Placeholder
-                        "size": file_stat.st_size
-                    })
+        for document_id, entry in DOCS.items():
+            modified = datetime.fromtimestamp(entry["mtime"])
+            documents.append({
+                "id": document_id,
+                "document_id": document_id,
+                "filename": entry["filename"],
+                "upload_date": modified,
+                "created_at": modified,
+                "pages": 1,  # Placeholder
+                "size": entry["size"]
+            })
         
         return documents
     except Exception as e:
@@ -563,19 +743,19 @@ async def delete_document(document_id: str):
         print(f"=== DELETE REQUEST ===")
         print(f"Document ID: {document_id}")
         
-        upload_dir = "./data/uploads"
         deleted_files = []
         
-        if os.path.exists(upload_dir):
-            for filename in os.listdir(upload_dir):
-                if filename.startswith(document_id + "_"):
-                    file_path = os.path.join(upload_dir, filename)
-                    try:
-                        os.remove(file_path)
-                        deleted_files.append(filename)
-                        print(f"Deleted file: {filename}")
-                    except Exception as e:
-                        print(f"Error deleting {filename}: {str(e)}")
+        entry = DOCS.pop(document_id, None)
+        response_cache.invalidate(document_id)
+        if entry:
+            filename = os.path.basename(entry["path"])
+            try:
+                os.remove(entry["path"])
+                _evict_processed(entry["path"])
+                deleted_files.append(filename)
+                print(f"Deleted file: {filename}")
+            except Exception as e:
+                print(f"Error deleting {filename}: {str(e)}")
         
         if deleted_files:
             return {"message": f"Successfully deleted {len(deleted_files)} file(s)", "deleted_files": deleted_files}
@@ -593,20 +773,20 @@ async def delete_all_documents():
     try:
         print(f"=== DELETE ALL REQUEST ===")
         
-        upload_dir = "./data/uploads"
         deleted_files = []
         
-        if os.path.exists(upload_dir):
-            for filename in os.listdir(upload_dir):
-                if filename.endswith(('.pdf', '.docx', '.txt')):
-                    file_path = os.path.join(upload_dir, filename)
-                    try:
-                        os.remove(file_path)
-                        deleted_files.append(filename)
-                        print(f"Deleted file: {filename}")
-                    except Exception as e:
-                        print(f"Error deleting {filename}: {str(e)}")
+        for entry in list(DOCS.values()):
+            filename = os.path.basename(entry["path"])
+            try:
+                os.remove(entry["path"])
+                deleted_files.append(filename)
+                print(f"Deleted file: {filename}")
+            except Exception as e:
+                print(f"Error deleting {filename}: {str(e)}")
         
+        DOCS.clear()
+        _processed_cache.clear()
+        response_cache.invalidate()
         return {
             "message": f"Successfully deleted {len(deleted_files)} file(s)", 
             "deleted_files": deleted_files
@@ -630,35 +810,74 @@ async def test():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {"status": "healthy", "timestamp": datetime.now()}
 
 @app.post("/reindex")
 async def reindex_all():
     """Rebuild the vector index from files present in ./data/uploads."""
-    upload_dir = "./data/uploads"
     results = []
-    if not os.path.exists(upload_dir):
-        return {"message": "No uploads directory found", "indexed": results}
-    for filename in os.listdir(upload_dir):
-        if filename.endswith((".pdf", ".docx", ".txt")):
-            file_path = os.path.join(upload_dir, filename)
-            info = await _index_saved_file(file_path, filename)
-            results.append(info)
+    if not DOCS:
+        return {"message": "No uploaded documents found", "indexed": results}
+    # Index files concurrently so parsing and embedding of different files overlap
+    sem = asyncio.Semaphore(int(os.getenv("REINDEX_CONCURRENCY", "4")))
+    # Chunks buffered across files before each insert, so embedding runs in full batches
+    flush_size = 128
+
+    async def _one(position: int, document_id: str, entry: dict):
+        async with sem:
+            return position, await _index_saved_file(document_id, entry["filename"], entry["path"])
+
+    entries = list(DOCS.items())
+    results = [None] * len(entries)
+    pending_chunks, pending_metadatas, pending_ids = [], [], []
+    # New chunk count per document in the pending batch, to trim each one's old tail after it lands
+    pending_counts = {}
+    total = 0
+
+    async def _flush():
+        nonlocal total
+        await retrieval_store.add_many(pending_chunks, pending_metadatas, pending_ids)
+        # Upsert only overwrites ids that still exist; a re-parse with fewer chunks would leave
+        # the old tail ({id}_{n}...) behind. Trimming after the write keeps a failed insert from
+        # leaving documents with no chunks at all.
+        for document_id, kept in pending_counts.items():
+            await retrieval_store.delete_stale_chunks(document_id, kept)
+        total += len(pending_chunks)
+
+    try:
+        for next_done in asyncio.as_completed([_one(i, d, entry) for i, (d, entry) in enumerate(entries)]):
+            position, (info, records) = await next_done
+            results[position] = info
+            if records:
+                chunks, metadatas, ids = records
+                pending_chunks.extend(chunks)
+                pending_metadatas.extend(metadatas)
+                pending_ids.extend(ids)
+                pending_counts[info["document_id"]] = len(chunks)
+            elif info.get("document_id"):
+                # Parsed, but no text any more: nothing to write, so its old chunks can go now
+                await retrieval_store.delete_document(info["document_id"])
+            if len(pending_chunks) >= flush_size:
+                await _flush()
+                pending_chunks, pending_metadatas, pending_ids = [], [], []
+                pending_counts = {}
+        if pending_chunks:
+            await _flush()
+        print(f"Reindexed {total} chunks from {len(entries)} file(s)")
+    except Exception as e:
+        print(f"Reindex insert failed: {str(e)}")
+        return {"error": f"Reindex failed: {str(e)}", "indexed": [r for r in results if r]}
+    finally:
+        response_cache.invalidate()
     return {"message": "Reindex completed", "indexed": results}
 
 @app.post("/clear_index")
 async def clear_index():
     """Clear all vectors from the collection (does not delete uploaded files)."""
     try:
-        # Chroma has no direct 'clear', so we can recreate the collection
-        # Get all ids and delete
-        if vector_store.collection is None:
-            return {"message": "Vector store not initialized"}
-        all_items = vector_store.collection.get(include=["ids"])
-        ids = all_items.get("ids", [])
-        if ids:
-            vector_store.collection.delete(ids=ids)
-        return {"message": f"Cleared {len(ids)} items from index"}
+        await retrieval_store.clear()
+        response_cache.invalidate()
+        return {"message": "Index cleared"}
     except Exception as e:
         return {"error": str(e)}
 
@@ -1,121 +1,79 @@
 import os
 import fitz  # PyMuPDF
-import docx
-from typing import Dict, List
+import zipfile
+from xml.etree import ElementTree
+from typing import Dict, List, Tuple
 import tiktoken
 import re
+import bisect
+import numpy as np
+import mmap
+import subprocess
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from services.ocr_cache import OCRCache
+
+# Chunk windows decoded per tiktoken call; bounds how many windows exist as Python int lists at once
+DECODE_BATCH_SIZE = 64
+# Threads decoding chunk windows; documents are already parsed several at a time
+DECODE_THREADS = min(4, os.cpu_count() or 1)
+
+# Characters dropped by DocumentProcessor._clean_text. RE2 (google-re2, optional) matches in
+# linear time without backtracking; its \w is ASCII-only, so letters and digits are spelled as
+# Unicode classes, which equal Python's \w. Whitespace is collapsed to spaces beforehand.
+try:
+    import re2
+    _SPECIAL_CHARS_RE = re2.compile(r'[^\p{L}\p{N}_\s.,!?;:()\-]')
+except ImportError:
+    _SPECIAL_CHARS_RE = re.compile(r'[^\w\s.,!?;:()\-]')
 
 class DocumentProcessor:
     def __init__(self):
         self.chunk_size = 800
         self.chunk_overlap = 150
         self.encoding = tiktoken.get_encoding("cl100k_base")
+        # Decode threads, started on the first document with more than one batch of windows
+        self._decode_pool = None
     
-    async def process_document(self, file_path: str, document_id: str, filename: str) -> Dict:
-        """Process document and return chunks with metadata"""
+    def process_document_sync(self, file_path: str, document_id: str, filename: str) -> Dict:
+        """Process document and return chunks with metadata (blocking; main runs it in a worker process)"""
         try:
-            # Check if file exists
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"File not found: {file_path}")
-            
-            file_extension = os.path.splitext(file_path)[1].lower()
+            file_extension = self._file_extension(file_path)
             
             if file_extension == '.pdf':
-                return await self._process_pdf(file_path, document_id, filename)
+                return self._process_pdf_sync(file_path, document_id, filename)
             elif file_extension == '.docx':
-                return await self._process_docx(file_path, document_id, filename)
+                return self._process_docx_sync(file_path, document_id, filename)
             elif file_extension == '.txt':
-                return await self._process_txt(file_path, document_id, filename)
+                return self._process_txt_sync(file_path, document_id, filename)
             else:
                 raise ValueError(f"Unsupported file type: {file_extension}")
                 
         except Exception as e:
             raise Exception(f"Error processing document: {str(e)}")
     
-    async def _process_pdf(self, file_path: str, document_id: str, filename: str) -> Dict:
-        """Process PDF document"""
-        doc = fitz.open(file_path)
-        text_content = []
-        page_texts = {}
+    def _file_extension(self, file_path: str) -> str:
+        # Check if file exists
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
         
+        return os.path.splitext(file_path)[1].lower()
+    
+    def _process_pdf_sync(self, file_path: str, document_id: str, filename: str) -> Dict:
+        """Process PDF document"""
         # Some PDFs are encrypted or contain only images; handle gracefully
         try:
-            num_pages = len(doc)
+            with fitz.open(file_path) as doc:
+                num_pages = len(doc)
         except Exception:
             num_pages = 0
         
-        for page_index in range(num_pages):
-            page = doc[page_index]
-            page_number = page_index + 1
-            extracted = ""
-            
-            # 1) Default text extraction
-            try:
-                extracted = page.get_text("text") or ""
-            except Exception:
-                extracted = ""
-            
-            # 2) If empty, try layout mode
-            if not extracted.strip():
-                try:
-                    extracted = page.get_text("layout") or ""
-                except Exception:
-                    pass
-            
-            # 3) If still empty, try blocks and join
-            if not extracted.strip():
-                try:
-                    blocks = page.get_text("blocks") or []
-                    if isinstance(blocks, list):
-                        extracted = "\n".join([b[4] for b in blocks if isinstance(b, (tuple, list)) and len(b) > 4 and isinstance(b[4], str)])
-                except Exception:
-                    pass
-            
-            # 4) As a fallback, try PyPDF2 (helps on some files)
-            if not extracted.strip():
-                try:
-                    import PyPDF2
-                    with open(file_path, 'rb') as fh:
-                        reader = PyPDF2.PdfReader(fh)
-                        if page_index < len(reader.pages):
-                            extracted = reader.pages[page_index].extract_text() or ""
-                except Exception:
-                    pass
-
-            # 5) Ultimate fallback: OCR the page image if Tesseract is available
-            if not extracted.strip():
-                try:
-                    # Render page to image using PyMuPDF
-                    pix = page.get_pixmap(dpi=200)
-                    if pix and pix.samples:
-                        # Lazy imports to avoid hard dependency if user doesn't need OCR
-                        try:
-                            from PIL import Image
-                            import io
-                            import pytesseract
-                            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                            # OCR with English as default; users can configure TESSDATA_PREFIX if needed
-                            ocr_text = pytesseract.image_to_string(img)
-                            if isinstance(ocr_text, str):
-                                extracted = ocr_text
-                        except ImportError:
-                            # OCR not available; skip silently
-                            pass
-                        except Exception:
-                            # Any OCR failure should not break the pipeline
-                            pass
-                except Exception:
-                    # Rendering failure, continue
-                    pass
-            
-            # Record extracted text (may be empty for scanned PDFs)
-            text_content.append(extracted)
-            page_texts[page_number] = extracted
-        
-        doc.close()
+        # Record extracted text (may be empty for scanned PDFs); page_texts[i] is page i + 1
+        page_texts = _extract_pdf_pages(file_path, num_pages)
         
-        full_text = "\n".join([t for t in text_content if isinstance(t, str)])
-        if not full_text.strip():
+        # Checking pages in place avoids joining a document-sized string just to test it
+        if not any(_has_text(t) for t in page_texts):
             # Return a minimal placeholder so upstream can notify the user clearly
             return {
                 "chunks": [
@@ -131,12 +89,26 @@ class DocumentProcessor:
                 "filename": filename
             }
         
-        chunks = self._chunk_text(full_text)
+        # Tokenize page by page, recording where each page starts in the token stream
+        page_tokens = []
+        page_token_offsets = []
+        total_tokens = 0
+        for page_text in page_texts:
+            page_token_offsets.append(total_tokens)
+            cleaned = self._clean_text(page_text)
+            if cleaned:
+                # Leading space keeps the page boundary a word boundary
+                ids = self.encoding.encode_ordinary(f" {cleaned}" if total_tokens else cleaned)
+                page_tokens.append(np.asarray(ids, dtype=np.int32))
+                total_tokens += len(ids)
+        
+        tokens = np.concatenate(page_tokens) if page_tokens else np.empty(0, dtype=np.int32)
+        chunks, chunk_starts = self._chunk_tokens(tokens)
         
-        # Add page information to chunks
+        # Add page information to chunks: the page containing the chunk's first token
         chunked_metadata = []
-        for chunk in chunks:
-            page_num = self._find_page_for_chunk(chunk, page_texts)
+        for start in chunk_starts:
+            page_num = bisect.bisect_right(page_token_offsets, start)
             chunked_metadata.append({
                 "document_id": document_id,
                 "filename": filename,
@@ -151,17 +123,11 @@ class DocumentProcessor:
             "filename": filename
         }
     
-    async def _process_docx(self, file_path: str, document_id: str, filename: str) -> Dict:
+    def _process_docx_sync(self, file_path: str, document_id: str, filename: str) -> Dict:
         """Process DOCX document"""
-        doc = docx.Document(file_path)
-        text_content = []
-        
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text_content.append(paragraph.text)
-        
-        full_text = "\n".join(text_content)
-        chunks = self._chunk_text(full_text)
+        # Empty paragraphs only add whitespace, which cleaning collapses
+        full_text = "\n".join(_docx_paragraphs(file_path))
+        chunks, _ = self._chunk_text(full_text)
         
         chunked_metadata = []
         for i, chunk in enumerate(chunks):
@@ -179,12 +145,12 @@ class DocumentProcessor:
             "filename": filename
         }
     
-    async def _process_txt(self, file_path: str, document_id: str, filename: str) -> Dict:
+    def _process_txt_sync(self, file_path: str, document_id: str, filename: str) -> Dict:
         """Process TXT document"""
         with open(file_path, 'r', encoding='utf-8') as file:
             full_text = file.read()
         
-        chunks = self._chunk_text(full_text)
+        chunks, _ = self._chunk_text(full_text)
         
         chunked_metadata = []
         for i, chunk in enumerate(chunks):
@@ -202,58 +168,317 @@ class DocumentProcessor:
             "filename": filename
         }
     
-    def _chunk_text(self, text: str) -> List[str]:
-        """Split text into chunks with overlap"""
-        # Tokenize text
-        tokens = self.encoding.encode(text)
+    def _chunk_text(self, text: str) -> Tuple[List[str], List[int]]:
+        """Split text into chunks with overlap; returns (chunks, start token index of each chunk)"""
+        # Clean the whole text once; chunk windows are cut from the cleaned text
+        text = self._clean_text(text)
         
-        chunks = []
-        start = 0
+        # Tokenize text (no special-token handling needed for document content);
+        # int32 storage is a fraction of a list of Python ints
+        tokens = np.asarray(self.encoding.encode_ordinary(text), dtype=np.int32)
+        return self._chunk_tokens(tokens)
+    
+    def _chunk_tokens(self, tokens: np.ndarray) -> Tuple[List[str], List[int]]:
+        """Split a token array into overlapping windows and decode them"""
+        # Fixed-stride window starts; the last window always reaches the end of tokens
+        stride = self.chunk_size - self.chunk_overlap
+        starts = range(0, max(1, len(tokens) - self.chunk_overlap), stride) if len(tokens) else range(0)
         
-        while start < len(tokens):
-            # Get chunk tokens
-            end = min(start + self.chunk_size, len(tokens))
-            chunk_tokens = tokens[start:end]
-            
-            # Decode chunk
-            chunk_text = self.encoding.decode(chunk_tokens)
-            
-            # Clean up chunk
-            chunk_text = self._clean_text(chunk_text)
-            
-            if chunk_text.strip():
-                chunks.append(chunk_text)
-            
-            # Move start position with overlap
-            start = end - self.chunk_overlap
+        chunks = []
+        chunk_starts = []
+        # A single batch decodes inline; longer documents share this processor's thread pool
+        # (tiktoken's Rust decode releases the GIL; decode_batch would build a new pool per call)
+        decode_map = map
+        if len(starts) > DECODE_BATCH_SIZE:
+            if self._decode_pool is None:
+                self._decode_pool = ThreadPoolExecutor(max_workers=DECODE_THREADS)
+            decode_map = self._decode_pool.map
+        for batch_start in range(0, len(starts), DECODE_BATCH_SIZE):
+            batch = starts[batch_start:batch_start + DECODE_BATCH_SIZE]
+            windows = [tokens[start:start + self.chunk_size].tolist() for start in batch]
             
-            # Prevent infinite loop
-            if start >= len(tokens) - self.chunk_overlap:
-                break
+            for start, chunk_text in zip(batch, decode_map(self.encoding.decode, windows)):
+                # Windows can start or end on whitespace tokens
+                chunk_text = chunk_text.strip()
+                if chunk_text:
+                    chunks.append(chunk_text)
+                    chunk_starts.append(start)
         
-        return chunks
+        return chunks, chunk_starts
     
     def _clean_text(self, text: str) -> str:
         """Clean and normalize text"""
-        # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
+        # Remove excessive whitespace (split/join runs in C and matches re's \s)
+        text = " ".join(text.split())
         # Remove special characters that might cause issues
-        text = re.sub(r'[^\w\s.,!?;:()\-]', '', text)
+        text = _SPECIAL_CHARS_RE.sub('', text)
         return text.strip()
+
+
+# Pages per PDF handled in parallel processes; 1 disables parallel extraction
+PDF_PAGE_WORKERS = max(1, int(os.getenv("PDF_PAGE_WORKERS", str(min(os.cpu_count() or 1, 4)))))
+# Smaller PDFs are extracted in-process; worker startup would cost more than it saves
+PDF_PARALLEL_MIN_PAGES = 16
+# Documents parsed at once by the API's process pool (see main.PROC_POOL)
+DOCUMENT_WORKERS = max(1, min((os.cpu_count() or 2) - 1, 4))
+# Tesseract scales to about 4 threads, so each OCR process gets up to 4 cores
+OCR_THREADS = min(4, os.cpu_count() or 1)
+# Tesseract processes running at once across every extraction process, so together they fill
+# the cores; a single scanned upload still gets all of them
+OCR_PROCESSES = max(1, (os.cpu_count() or 1) // OCR_THREADS)
+OCR_CONFIG = ["--oem", "1", "--psm", "6", "-c", "tessedit_do_invert=0"]
+
+
+class _LazyPyPDF2Reader:
+    """PyPDF2 reader over a memory-mapped file, parsed once on first use"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.reader = None
+        self.failed = False
+        self._fh = None
+        self._mm = None
+
+    def get(self):
+        if self.reader is None and not self.failed:
+            try:
+                import PyPDF2
+                self._fh = open(self.file_path, 'rb')
+                self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+                self.reader = PyPDF2.PdfReader(self._mm, strict=False)
+            except Exception:
+                self.failed = True
+        return self.reader
+
+    def close(self):
+        self.reader = None
+        if self._mm is not None:
+            self._mm.close()
+        if self._fh is not None:
+            self._fh.close()
+
+
+def _has_text(text: str) -> bool:
+    return bool(text) and not text.isspace()
+
+
+def _extract_page(page, page_index: int, pypdf: _LazyPyPDF2Reader) -> str:
+    """Extract one page's text, falling back through layout, blocks and PyPDF2 (OCR runs separately)"""
+    extracted = ""
+
+    # 1) Default text extraction
+    try:
+        extracted = page.get_text("text") or ""
+    except Exception:
+        extracted = ""
+    # isspace() checks in C without allocating a stripped copy; most pages stop here
+    found = _has_text(extracted)
+
+    # 2) If empty, try layout mode
+    if not found:
+        try:
+            extracted = page.get_text("layout") or ""
+            found = _has_text(extracted)
+        except Exception:
+            pass
+
+    # 3) If still empty, try blocks and join
+    if not found:
+        try:
+            blocks = page.get_text("blocks") or []
+            if isinstance(blocks, list):
+                extracted = "\n".join([b[4] for b in blocks if isinstance(b, (tuple, list)) and len(b) > 4 and isinstance(b[4], str)])
+                found = _has_text(extracted)
+        except Exception:
+            pass
+
+    # 4) As a fallback, try PyPDF2 (helps on some files)
+    if not found:
+        try:
+            reader = pypdf.get()
+            if reader is not None and page_index < len(reader.pages):
+                extracted = reader.pages[page_index].extract_text() or ""
+        except Exception:
+            pass
+
+    return extracted
+
+
+def _render_page(page):
+    """Render a page at 200 DPI for OCR; None if rendering fails"""
+    try:
+        pix = page.get_pixmap(dpi=200)
+        if pix and pix.samples:
+            return pix
+    except Exception:
+        # Rendering failure, continue
+        pass
+    return None
+
+
+# Semaphore with OCR_PROCESSES slots shared by the extraction processes; None outside a pool
+_ocr_slots = None
+
+
+def init_ocr_slots(slots):
+    """Pool initializer handing each worker the shared OCR slots"""
+    global _ocr_slots
+    _ocr_slots = slots
+
+
+def _ocr_png(png: bytes, threads: int = OCR_THREADS) -> str:
+    """OCR one PNG by piping it to tesseract; empty if Tesseract is unavailable or fails"""
+    try:
+        # Lazy import to avoid hard dependency if user doesn't need OCR; honours a configured tesseract_cmd
+        import pytesseract
+    except ImportError:
+        # OCR not available; skip silently
+        return ""
+    # English by default; users can configure TESSDATA_PREFIX if needed
+    env = {**os.environ, "OMP_THREAD_LIMIT": str(threads)}
+    try:
+        with _ocr_slots or contextlib.nullcontext():
+            result = subprocess.run(
+                [pytesseract.pytesseract.tesseract_cmd, "stdin", "stdout", *OCR_CONFIG],
+                input=png,
+                capture_output=True,
+                env=env,
+                check=True
+            )
+        return result.stdout.decode("utf-8", errors="ignore")
+    except Exception:
+        # Any OCR failure should not break the pipeline
+        return ""
+
+
+def _ocr_pages(pngs: List[bytes], workers: int, threads: int) -> List[str]:
+    """OCR several page images, running up to workers tesseract processes at once"""
+    if len(pngs) <= 1 or workers == 1:
+        return [_ocr_png(png, threads) for png in pngs]
+    # Tesseract runs out of process, so threads are enough to keep several going
+    with ThreadPoolExecutor(max_workers=min(workers, len(pngs))) as pool:
+        return list(pool.map(_ocr_png, pngs, [threads] * len(pngs)))
+
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> List[str]:
+    """Extract pages [start, stop) with a document handle owned by the calling process"""
+    texts = [""] * (stop - start)
+    # (position in texts, cache key, PNG) for pages with no text layer, OCRed in batches
+    pending = []
+    # Opened on the first page that needs OCR; most PDFs have a text layer throughout
+    ocr_cache = None
+    pypdf = _LazyPyPDF2Reader(file_path)
+    ocr_config = " ".join(OCR_CONFIG)
+    # Rendered pages held in memory before they are OCRed
+    ocr_batch_size = OCR_PROCESSES * 4
     
-    def _find_page_for_chunk(self, chunk: str, page_texts: Dict[int, str]) -> int:
-        """Find which page a chunk belongs to"""
-        chunk_words = set(chunk.lower().split())
-        
-        best_page = 1
-        max_overlap = 0
-        
-        for page_num, page_text in page_texts.items():
-            page_words = set(page_text.lower().split())
-            overlap = len(chunk_words.intersection(page_words))
-            
-            if overlap > max_overlap:
-                max_overlap = overlap
-                best_page = page_num
-        
-        return best_page
+    def flush_ocr():
+        if not pending:
+            return
+        results = _ocr_pages([png for _, _, png in pending], OCR_PROCESSES, OCR_THREADS)
+        for (position, _, _), ocr_text in zip(pending, results):
+            if ocr_text:
+                texts[position] = ocr_text
+        # Empty results may just mean Tesseract is missing, so they aren't cached
+        ocr_cache.put_many((key, text) for (_, key, _), text in zip(pending, results) if text)
+        pending.clear()
+    
+    try:
+        with fitz.open(file_path) as doc:
+            for position, page_index in enumerate(range(start, stop)):
+                page = doc[page_index]
+                extracted = _extract_page(page, page_index, pypdf)
+                
+                # Ultimate fallback: OCR the page image if Tesseract is available
+                if not _has_text(extracted):
+                    pix = _render_page(page)
+                    if pix is not None:
+                        if ocr_cache is None:
+                            ocr_cache = OCRCache()
+                        key = OCRCache.key(pix.samples, ocr_config)
+                        cached = ocr_cache.get(key)
+                        if cached is not None:
+                            extracted = cached
+                        else:
+                            # MuPDF's own PNG encoder; tesseract reads it from stdin
+                            pending.append((position, key, pix.tobytes("png")))
+                texts[position] = extracted
+                
+                if len(pending) >= ocr_batch_size:
+                    flush_ocr()
+        flush_ocr()
+    finally:
+        pypdf.close()
+        if ocr_cache is not None:
+            ocr_cache.close()
+    return texts
+
+
+def _extract_pdf_pages(file_path: str, num_pages: int) -> List[str]:
+    """Extract every page's text in page order.
+
+    MuPDF is not thread-safe, so large PDFs are split into contiguous page
+    ranges that run in separate processes, each opening its own document.
+    """
+    if num_pages <= 0:
+        return []
+    workers = min(PDF_PAGE_WORKERS, num_pages // PDF_PARALLEL_MIN_PAGES)
+    if workers <= 1:
+        return _extract_page_range(file_path, 0, num_pages)
+    
+    step = -(-num_pages // workers)
+    ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+    page_texts = [""] * num_pages
+    # Not forked: this process may be running the idle decode threads of an earlier document
+    mp_context = multiprocessing.get_context(
+        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    )
+    with ProcessPoolExecutor(
+        max_workers=len(ranges), mp_context=mp_context, initializer=init_ocr_slots, initargs=(_ocr_slots,)
+    ) as pool:
+        futures = [pool.submit(_extract_page_range, file_path, start, stop) for start, stop in ranges]
+        for (start, stop), future in zip(ranges, futures):
+            page_texts[start:stop] = future.result()
+    return page_texts
+
+
+# WordprocessingML namespace used in word/document.xml
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _docx_paragraphs(file_path: str):
+    """Yield the text of each paragraph in a .docx (body, tables, text boxes).
+
+    Streams word/document.xml from the zip instead of building python-docx's
+    object model, clearing each paragraph once its text has been emitted.
+    """
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml:
+        # Text of each open paragraph; a text box's paragraphs nest inside their anchor's
+        open_paragraphs = []
+        for event, elem in ElementTree.iterparse(xml, events=("start", "end")):
+            tag = elem.tag
+            if tag == _W + "p":
+                if event == "start":
+                    open_paragraphs.append([])
+                else:
+                    yield "".join(open_paragraphs.pop())
+                    elem.clear()
+            elif event == "start" or not open_paragraphs:
+                continue
+            elif tag == _W + "t":
+                open_paragraphs[-1].append(elem.text or "")
+            elif tag == _W + "tab":
+                open_paragraphs[-1].append("\t")
+            elif tag == _W + "br" or tag == _W + "cr":
+                open_paragraphs[-1].append("\n")
+
+
+# Per-process instance used by process_document_file (each pool worker builds its own)
+_worker_processor = None
+
+def process_document_file(file_path: str, document_id: str, filename: str) -> Dict:
+    """Module-level entry point so documents can be processed in a ProcessPoolExecutor"""
+    global _worker_processor
+    if _worker_processor is None:
+        _worker_processor = DocumentProcessor()
+    return _worker_processor.process_document_sync(file_path, document_id, filename)
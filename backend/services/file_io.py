@@ -0,0 +1,44 @@
+import os
+import sys
+import asyncio
+
+import aiofiles
+from fastapi import UploadFile
+
+# Bytes per read/write when streaming through Python
+CHUNK_SIZE = 1 << 20
+# Bytes per sendfile call for kernel-side copies
+SENDFILE_CHUNK = 16 << 20
+
+
+def _sendfile_copy(src_fd: int, dst_path: str, offset: int) -> int:
+    """Copy src_fd from offset into dst_path inside the kernel (no userspace buffers)"""
+    copied = 0
+    with open(dst_path, "wb") as dst:
+        while True:
+            sent = os.sendfile(dst.fileno(), src_fd, offset + copied, SENDFILE_CHUNK)
+            if sent == 0:
+                break
+            copied += sent
+    return copied
+
+
+async def copy_upload_to_disk(upload: UploadFile, dst_path: str) -> int:
+    """Save an uploaded file to dst_path and return its size in bytes.
+
+    Starlette spools uploads larger than 1 MB to a temporary file; on Linux
+    those are copied with os.sendfile in a worker thread. Small in-memory
+    uploads, other platforms and sendfile failures use a chunked aiofiles copy.
+    """
+    src = upload.file
+    if sys.platform.startswith("linux") and hasattr(os, "sendfile") and getattr(src, "_rolled", False):
+        try:
+            return await asyncio.to_thread(_sendfile_copy, src.fileno(), dst_path, src.tell())
+        except OSError as e:
+            # sendfile doesn't move the source position, so the fallback starts from the same place
+            print(f"sendfile copy failed ({e}); falling back to chunked copy")
+
+    async with aiofiles.open(dst_path, "wb") as out:
+        while chunk := await upload.read(CHUNK_SIZE):
+            await out.write(chunk)
+    return os.path.getsize(dst_path)
@@ -2,6 +2,8 @@ import os
 from typing import List, Dict, Optional
 from datetime import datetime
 
+import numpy as np
+
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
 
@@ -9,6 +11,8 @@ from langchain_community.embeddings.sentence_transformer import SentenceTransfor
 class LangChainStore:
     """A thin wrapper around LangChain's Chroma to align with our VectorStore API."""
 
+    ADD_BATCH_SIZE = 200
+
     def __init__(self):
         self.chroma_dir = os.getenv("LC_CHROMA_DIR", "./data/lc_persisted")
         self.collection_name = os.getenv("LC_COLLECTION", "docology_documents_lc")
@@ -20,29 +24,47 @@ class LangChainStore:
         os.makedirs(self.chroma_dir, exist_ok=True)
         # Create embeddings
         self.embedder = SentenceTransformerEmbeddings(model_name=self.embed_model)
+        self.store = self._open_store()
+
+    def _open_store(self) -> Chroma:
         # Initialize persisted Chroma store (LangChain wrapper manages collection internally)
-        self.store = Chroma(
+        return Chroma(
             collection_name=self.collection_name,
             embedding_function=self.embedder,
             persist_directory=self.chroma_dir,
         )
 
+    def prepare_records(self, document_id: str, chunks: List[str], metadata: List[Dict]):
+        ids = list(map(f"{document_id}_".__add__, map(str, range(len(chunks)))))
+        # One timestamp for the whole document; processor metadata already has filename/page/chunk_index
+        created_at = datetime.now().isoformat()
+        metadatas = [{**meta, "document_id": document_id, "created_at": created_at} for meta in metadata]
+        return ids, metadatas
+
     async def add_document(self, document_id: str, chunks: List[str], metadata: List[Dict]):
+        ids, metadatas = self.prepare_records(document_id, chunks, metadata)
+        await self.add_many(chunks, metadatas, ids)
+
+    async def add_many(self, chunks: List[str], metadatas: List[Dict], ids: List[str]):
         if not self.store:
             raise Exception("LangChainStore not initialized")
-        metadatas = []
-        for i, meta in enumerate(metadata):
-            metadatas.append({
-                "document_id": document_id,
-                "filename": meta.get("filename"),
-                "page": meta.get("page"),
-                "chunk_index": meta.get("chunk_index"),
-                "created_at": datetime.now().isoformat(),
-            })
-        # Add texts with metadata
-        self.store.add_texts(texts=chunks, metadatas=metadatas)
-        # Persist to disk
-        self.store.persist()
+        # Add texts with metadata in batches of ADD_BATCH_SIZE
+        for start in range(0, len(chunks), self.ADD_BATCH_SIZE):
+            end = start + self.ADD_BATCH_SIZE
+            self.store.add_texts(texts=chunks[start:end], metadatas=metadatas[start:end], ids=ids[start:end])
+        # No persist() per add: Chroma >= 0.4 writes through to disk; flush() runs at shutdown
+
+    async def flush(self):
+        """Explicit persist for older Chroma clients (a no-op on Chroma >= 0.4)"""
+        if self.store:
+            self.store.persist()
+
+    async def embed(self, text: str):
+        if not self.embedder:
+            raise Exception("LangChainStore not initialized")
+        vec = np.asarray(self.embedder.embed_query(text), dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
 
     async def search(self, query: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[Dict]:
         if not self.store:
@@ -61,7 +83,37 @@ class LangChainStore:
             })
         return out
 
+    async def search_by_embedding(self, embedding, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[Dict]:
+        if not self.store:
+            raise Exception("LangChainStore not initialized")
+        where = None
+        if document_ids:
+            where = {"document_id": {"$in": document_ids}}
+        # Unlike the query variant, the by-vector variant returns raw Chroma distances as scores
+        results = self.store.similarity_search_by_vector_with_relevance_scores(
+            [float(x) for x in embedding], k=top_k, filter=where
+        )
+        return [
+            {"text": doc.page_content, "metadata": doc.metadata, "distance": float(score)}
+            for doc, score in results
+        ]
+
+    async def delete_document(self, document_id: str):
+        if not self.store:
+            raise Exception("LangChainStore not initialized")
+        # The wrapper only deletes by id; filter on the underlying collection instead
+        self.store._collection.delete(where={"document_id": document_id})
+
+    async def delete_stale_chunks(self, document_id: str, keep: int):
+        if not self.store:
+            raise Exception("LangChainStore not initialized")
+        self.store._collection.delete(
+            where={"$and": [{"document_id": document_id}, {"chunk_index": {"$gte": keep}}]}
+        )
+
     async def clear(self):
-        if self.store:
-            self.store.delete_collection()
-            self.store.persist()
+        if not self.store:
+            raise Exception("LangChainStore not initialized")
+        self.store.delete_collection()
+        # The wrapper drops its collection handle on delete; open a fresh, empty one
+        self.store = self._open_store()
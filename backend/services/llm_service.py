@@ -1,8 +1,12 @@
 import os
+import asyncio
 import google.generativeai as genai
 from typing import List, Dict, AsyncGenerator
 import json
 
+# Prefix of the answer text yielded when generation fails
+LLM_ERROR_PREFIX = "Error generating response"
+
 class LLMService:
     def __init__(self):
         self.api_key = os.getenv("GOOGLE_API_KEY")
@@ -21,9 +25,11 @@ class LLMService:
             # Build prompt with guardrails
             prompt = self._build_prompt(query, context, citations)
             
-            # Generate response
-            response = self.model.generate_content(
+            # Start a streaming request; the call and each chunk fetch block, so they run in threads
+            response = await asyncio.to_thread(
+                self.model.generate_content,
                 prompt,
+                stream=True,
                 generation_config=genai.types.GenerationConfig(
                     temperature=0.1,
                     max_output_tokens=2048,
@@ -32,26 +38,22 @@ class LLMService:
                 )
             )
             
-            # Stream the response
-            if response.text:
-                # Split response into chunks for streaming effect
-                words = response.text.split()
-                chunk_size = 3  # Words per chunk
-                
-                for i in range(0, len(words), chunk_size):
-                    chunk = " ".join(words[i:i + chunk_size])
-                    if i + chunk_size < len(words):
-                        chunk += " "
-                    yield chunk
-                    
-                    # Small delay to simulate streaming
-                    import asyncio
-                    await asyncio.sleep(0.05)
-            else:
+            # Stream the response as Gemini produces it
+            chunks = iter(response)
+            produced = False
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk.text:
+                    produced = True
+                    yield chunk.text
+            
+            if not produced:
                 yield "I don't know the answer to that question based on the provided documents."
                 
         except Exception as e:
-            yield f"Error generating response: {str(e)}"
+            yield f"{LLM_ERROR_PREFIX}: {str(e)}"
     
     def _build_prompt(self, query: str, context: str, citations: List[Dict]) -> str:
         """Build the prompt with context and guardrails"""
@@ -0,0 +1,54 @@
+import os
+import hashlib
+import sqlite3
+from typing import Iterable, Optional, Tuple
+
+
+class OCRCache:
+    """SQLite table of OCR text keyed by a hash of the rendered page image.
+
+    Survives restarts and is shared by every worker process, so re-uploaded
+    documents and repeated pages (letterheads, form templates) skip Tesseract.
+    A cache that can't be opened is disabled rather than failing extraction.
+    """
+
+    def __init__(self):
+        self.cache_dir = os.getenv("OCR_CACHE_DIR", "./data/ocr_cache")
+        self.conn: Optional[sqlite3.Connection] = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.conn = sqlite3.connect(os.path.join(self.cache_dir, "ocr.sqlite3"), timeout=30)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        except sqlite3.Error as e:
+            print(f"OCR cache disabled: {str(e)}")
+            self.conn = None
+
+    @staticmethod
+    def key(samples: bytes, config: str) -> str:
+        # The OCR settings are part of the key so changing them doesn't serve stale text
+        digest = hashlib.blake2b(samples, digest_size=16)
+        digest.update(config.encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if self.conn is None:
+            return None
+        try:
+            row = self.conn.execute("SELECT text FROM ocr WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def put_many(self, items: Iterable[Tuple[str, str]]):
+        if self.conn is None:
+            return
+        try:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO ocr (key, text) VALUES (?, ?)", list(items))
+        except sqlite3.Error as e:
+            print(f"Failed to store OCR results: {str(e)}")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,54 @@
+import os
+import hashlib
+from typing import Dict, List, Optional
+
+import numpy as np
+from cachetools import TTLCache
+
+
+class ResponseCache:
+    """TTL cache of /ask answers keyed by the selected documents and the query embedding.
+
+    The key hashes the exact embedding. Queries are embedded from their
+    lowercased, stripped text, so repeats that differ only in case or
+    surrounding whitespace share an entry; any other rewording misses.
+    """
+
+    def __init__(self):
+        maxsize = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+        ttl = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        self.entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _key(self, document_ids: Optional[List[str]], embedding) -> tuple:
+        vec = np.ascontiguousarray(embedding, dtype=np.float32)
+        digest = hashlib.blake2b(vec.tobytes(), digest_size=16).digest()
+        # Selection order fixes the section order of multi-doc answers, and the id count picks the
+        # single- vs multi-doc path (["a", "a"] is multi-doc), so the key keeps the list as given
+        return tuple(document_ids or ()), digest
+
+    def get(self, document_ids: Optional[List[str]], embedding) -> Optional[Dict]:
+        entry = self.entries.get(self._key(document_ids, embedding))
+        if entry is None:
+            return None
+        return {"content": entry["content"], "citations": entry["citations"]}
+
+    def put(self, document_ids: Optional[List[str]], embedding, content: str, citations: List[Dict]):
+        self.entries[self._key(document_ids, embedding)] = {
+            "content": content,
+            "citations": citations,
+            "document_ids": frozenset(document_ids or ()),
+        }
+
+    def invalidate(self, document_id: Optional[str] = None):
+        """Drop answers that may depend on document_id; unscoped answers always go.
+        With no document_id, drop everything.
+        """
+        if document_id is None:
+            self.entries.clear()
+            return
+        stale = [
+            key for key, entry in list(self.entries.items())
+            if not entry["document_ids"] or document_id in entry["document_ids"]
+        ]
+        for key in stale:
+            self.entries.pop(key, None)
@@ -1,88 +1,164 @@
 import chromadb
 from chromadb.config import Settings
 import os
+import json
+import asyncio
 from typing import List, Dict, Optional
 from sentence_transformers import SentenceTransformer
+from cachetools import LRUCache
 import uuid
 from datetime import datetime
 from models.document import DocumentResponse
 
 class VectorStore:
+    # Chunks per collection.add call when inserting in bulk
+    ADD_BATCH_SIZE = 200
+
     def __init__(self):
         self.chroma_dir = os.getenv("CHROMA_DIR", "./data/persisted")
+        # When CHROMA_HOST is set, talk to a Chroma server instead of the embedded store
+        self.chroma_host = os.getenv("CHROMA_HOST")
+        self.chroma_port = int(os.getenv("CHROMA_PORT", "8000"))
+        self.collection_name = "docology_documents"
+        self.collection_metadata = {"hnsw:space": "cosine"}
         self.client = None
         self.collection = None
         self.embedder = None
+        # Recent query embeddings, keyed by normalized query text
+        self.query_embeddings = LRUCache(maxsize=int(os.getenv("QUERY_EMBED_CACHE_SIZE", "1024")))
+        # Per-document summary kept beside the collection so listing doesn't scan every chunk
+        self.docs_index_path = os.getenv("DOCS_INDEX_PATH", "./data/docs_index.json")
+        self.documents: Dict[str, Dict] = {}
+        # False until the index file is loaded or rebuilt; a partial index is never written
+        self._docs_index_ready = False
+        # Pending debounced write, so a burst of adds/deletes rewrites the file once
+        self._docs_index_save: Optional[asyncio.Task] = None
     
     async def initialize(self):
         """Initialize ChromaDB and embedding model"""
         try:
-            # Create directory if it doesn't exist
-            os.makedirs(self.chroma_dir, exist_ok=True)
-            
             # Initialize ChromaDB client
-            self.client = chromadb.PersistentClient(
-                path=self.chroma_dir,
-                settings=Settings(anonymized_telemetry=False)
-            )
+            if self.chroma_host:
+                self.client = chromadb.HttpClient(
+                    host=self.chroma_host,
+                    port=self.chroma_port,
+                    settings=Settings(anonymized_telemetry=False)
+                )
+            else:
+                # Create directory if it doesn't exist
+                os.makedirs(self.chroma_dir, exist_ok=True)
+                self.client = chromadb.PersistentClient(
+                    path=self.chroma_dir,
+                    settings=Settings(anonymized_telemetry=False)
+                )
             
             # Get or create collection
             self.collection = self.client.get_or_create_collection(
-                name="docology_documents",
-                metadata={"hnsw:space": "cosine"}
+                name=self.collection_name,
+                metadata=self.collection_metadata
             )
             
-            # Initialize embedding model
-            self.embedder = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+            # Initialize embedding model once; EMBED_DEVICE (e.g. "cuda") overrides auto-detection
+            self.embedder = SentenceTransformer(
+                'sentence-transformers/all-MiniLM-L6-v2',
+                device=os.getenv("EMBED_DEVICE") or None
+            )
+            # Half precision halves memory traffic on GPU; CPU kernels stay in float32
+            if self.embedder.device.type == "cuda":
+                self.embedder.half()
+            
+            await self._load_docs_index()
             
             print("Vector store initialized successfully")
             
         except Exception as e:
             raise Exception(f"Failed to initialize vector store: {str(e)}")
     
+    def prepare_records(self, document_id: str, chunks: List[str], metadata: List[Dict]):
+        """Build the (ids, metadatas) ChromaDB expects for a document's chunks"""
+        ids = list(map(f"{document_id}_".__add__, map(str, range(len(chunks)))))
+        # One timestamp for the whole document; processor metadata already has filename/page/chunk_index
+        created_at = datetime.now().isoformat()
+        metadatas = [{**meta, "document_id": document_id, "created_at": created_at} for meta in metadata]
+        
+        return ids, metadatas
+    
     async def add_document(self, document_id: str, chunks: List[str], metadata: List[Dict]):
         """Add document chunks to vector store"""
         try:
-            if not self.collection or not self.embedder:
-                raise Exception("Vector store not initialized")
-            
-            # Generate embeddings
-            embeddings = self.embedder.encode(chunks).tolist()
-            
-            # Prepare data for ChromaDB
-            ids = [f"{document_id}_{i}" for i in range(len(chunks))]
-            metadatas = []
-            
-            for i, meta in enumerate(metadata):
-                metadatas.append({
-                    "document_id": document_id,
-                    "filename": meta["filename"],
-                    "page": meta["page"],
-                    "chunk_index": meta["chunk_index"],
-                    "created_at": datetime.now().isoformat()
-                })
-            
-            # Add to collection
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings,
-                documents=chunks,
-                metadatas=metadatas
-            )
-            
+            ids, metadatas = self.prepare_records(document_id, chunks, metadata)
+            await self.add_many(chunks, metadatas, ids)
             print(f"Added {len(chunks)} chunks for document {document_id}")
             
         except Exception as e:
             raise Exception(f"Failed to add document to vector store: {str(e)}")
     
+    async def add_many(self, chunks: List[str], metadatas: List[Dict], ids: List[str]):
+        """Add prepared chunks (possibly from many documents) in batches of ADD_BATCH_SIZE"""
+        if not self.collection or not self.embedder:
+            raise Exception("Vector store not initialized")
+        
+        # Embedding and Chroma calls block, so they run in worker threads
+        for start in range(0, len(chunks), self.ADD_BATCH_SIZE):
+            end = start + self.ADD_BATCH_SIZE
+            # Embeddings are computed here rather than by Chroma's embedding function
+            embeddings = await asyncio.to_thread(self.embed_texts, chunks[start:end])
+            # Upsert so re-indexing a document overwrites its chunks instead of failing on duplicate ids
+            await asyncio.to_thread(
+                self.collection.upsert,
+                ids=ids[start:end],
+                # chromadb 0.4 only accepts lists here; ndarray input needs 0.5+
+                embeddings=embeddings.tolist(),
+                documents=chunks[start:end],
+                metadatas=metadatas[start:end]
+            )
+        
+        self._record_documents(metadatas)
+        self._schedule_docs_index_save()
+    
+    def embed_texts(self, texts: List[str], batch_size: int = 64):
+        """Embed texts in model batches of batch_size; returns an (n, dim) L2-normalized numpy array"""
+        if not self.embedder:
+            raise Exception("Vector store not initialized")
+        return self.embedder.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+    
+    async def embed(self, text: str):
+        """Embed a query with the store's model (L2-normalized numpy vector)"""
+        if not self.embedder:
+            raise Exception("Vector store not initialized")
+        # MiniLM's tokenizer is uncased and ignores outer whitespace, so these queries embed identically
+        key = text.strip().lower()
+        embedding = self.query_embeddings.get(key)
+        if embedding is None:
+            embedding = (await asyncio.to_thread(self.embedder.encode, [text], normalize_embeddings=True))[0]
+            self.query_embeddings[key] = embedding
+        return embedding
+
     async def search(self, query: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[Dict]:
         """Search for relevant chunks"""
         try:
             if not self.collection or not self.embedder:
                 raise Exception("Vector store not initialized")
             
-            # Generate query embedding
-            query_embedding = self.embedder.encode([query]).tolist()[0]
+            # Generate query embedding (cached across repeated queries)
+            query_embedding = await self.embed(query)
+            
+        except Exception as e:
+            raise Exception(f"Failed to search vector store: {str(e)}")
+        
+        return await self.search_by_embedding(query_embedding, top_k=top_k, document_ids=document_ids)
+    
+    async def search_by_embedding(self, embedding, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[Dict]:
+        """Search for relevant chunks with a precomputed query embedding (e.g. from embed())"""
+        try:
+            if not self.collection:
+                raise Exception("Vector store not initialized")
             
             # Prepare where clause for document filtering
             where_clause = None
@@ -90,8 +166,9 @@ class VectorStore:
                 where_clause = {"document_id": {"$in": document_ids}}
             
             # Search with MMR (Maximal Marginal Relevance)
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
+            results = await asyncio.to_thread(
+                self.collection.query,
+                query_embeddings=[[float(x) for x in embedding]],
                 n_results=top_k,
                 where=where_clause,
                 include=["documents", "metadatas", "distances"]
@@ -112,37 +189,102 @@ class VectorStore:
         except Exception as e:
             raise Exception(f"Failed to search vector store: {str(e)}")
     
+    def _record_documents(self, metadatas: List[Dict]):
+        """Fold chunk metadata into the per-document index"""
+        for metadata in metadatas:
+            doc_id = metadata["document_id"]
+            if doc_id not in self.documents:
+                self.documents[doc_id] = {
+                    "id": doc_id,
+                    "filename": metadata["filename"],
+                    "pages": 0,
+                    "size": 0,
+                    "created_at": metadata["created_at"]
+                }
+            
+            # Count pages (approximate)
+            if metadata["page"] != "Unknown":
+                try:
+                    page_num = int(metadata["page"])
+                    self.documents[doc_id]["pages"] = max(self.documents[doc_id]["pages"], page_num)
+                except:
+                    pass
+    
+    async def _load_docs_index(self):
+        """Load the document index file if it matches the collection.
+
+        The file records the collection's chunk count when it was written; a
+        missing file or a different count (e.g. after a crash before a pending
+        write) leaves the index to be rebuilt lazily by list_documents.
+        """
+        saved = await asyncio.to_thread(self._read_docs_index)
+        if not saved:
+            return
+        count = await asyncio.to_thread(self.collection.count)
+        if saved.get("chunk_count") == count:
+            self.documents = saved.get("documents", {})
+            self._docs_index_ready = True
+        else:
+            print("Document index is out of date; it will be rebuilt on first use")
+    
+    def _read_docs_index(self) -> Optional[Dict]:
+        if not os.path.exists(self.docs_index_path):
+            return None
+        try:
+            with open(self.docs_index_path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable document index: {str(e)}")
+            return None
+    
+    async def _rebuild_docs_index(self):
+        # One full metadata scan, e.g. for collections indexed before the side index existed
+        results = await asyncio.to_thread(self.collection.get, include=["metadatas"])
+        self.documents = {}
+        self._record_documents(results["metadatas"])
+        self._docs_index_ready = True
+        self._schedule_docs_index_save()
+    
+    def _schedule_docs_index_save(self, delay: float = 1.0):
+        if self._docs_index_save is None or self._docs_index_save.done():
+            self._docs_index_save = asyncio.create_task(self._save_docs_index_later(delay))
+    
+    async def _save_docs_index_later(self, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            await self._save_docs_index()
+        except Exception as e:
+            print(f"Failed to save document index: {str(e)}")
+    
+    async def _save_docs_index(self):
+        """Write the document index with the collection's current chunk count"""
+        if not self._docs_index_ready:
+            return
+        count = await asyncio.to_thread(self.collection.count)
+        # Serialize on the event loop so the snapshot is consistent, write in a thread
+        payload = json.dumps({"chunk_count": count, "documents": self.documents})
+        await asyncio.to_thread(self._write_docs_index, payload)
+    
+    def _write_docs_index(self, payload: str):
+        index_dir = os.path.dirname(self.docs_index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        tmp_path = f"{self.docs_index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            fh.write(payload)
+        os.replace(tmp_path, self.docs_index_path)
+    
     async def list_documents(self) -> List[DocumentResponse]:
         """List all unique documents in the collection"""
         try:
             if not self.collection:
                 raise Exception("Vector store not initialized")
             
-            # Get all documents
-            results = self.collection.get(include=["metadatas"])
-            
-            # Group by document_id
-            documents = {}
-            for i, metadata in enumerate(results["metadatas"]):
-                doc_id = metadata["document_id"]
-                if doc_id not in documents:
-                    documents[doc_id] = {
-                        "id": doc_id,
-                        "filename": metadata["filename"],
-                        "pages": 0,
-                        "size": 0,
-                        "created_at": metadata["created_at"]
-                    }
-                
-                # Count pages (approximate)
-                if metadata["page"] != "Unknown":
-                    try:
-                        page_num = int(metadata["page"])
-                        documents[doc_id]["pages"] = max(documents[doc_id]["pages"], page_num)
-                    except:
-                        pass
-            
-            return list(documents.values())
+            if not self._docs_index_ready:
+                await self._rebuild_docs_index()
+            
+            # Read from the document index: O(documents), not O(chunks)
+            return [dict(entry) for entry in self.documents.values()]
             
         except Exception as e:
             raise Exception(f"Failed to list documents: {str(e)}")
@@ -153,16 +295,47 @@ class VectorStore:
             if not self.collection:
                 raise Exception("Vector store not initialized")
             
-            # Get all chunks for this document
-            results = self.collection.get(
-                where={"document_id": document_id},
-                include=["ids"]
-            )
-            
-            if results["ids"]:
-                # Delete all chunks
-                self.collection.delete(ids=results["ids"])
-                print(f"Deleted document {document_id} with {len(results['ids'])} chunks")
+            # Delete all chunks with a metadata filter; no id lookup needed
+            await asyncio.to_thread(self.collection.delete, where={"document_id": document_id})
+            self.documents.pop(document_id, None)
+            self._schedule_docs_index_save()
+            print(f"Deleted document {document_id}")
             
         except Exception as e:
             raise Exception(f"Failed to delete document: {str(e)}")
+    
+    async def delete_stale_chunks(self, document_id: str, keep: int):
+        """Delete a document's chunks from chunk_index `keep` on, left over from a longer earlier version"""
+        if not self.collection:
+            raise Exception("Vector store not initialized")
+        await asyncio.to_thread(
+            self.collection.delete,
+            where={"$and": [{"document_id": document_id}, {"chunk_index": {"$gte": keep}}]},
+        )
+    
+    async def flush(self):
+        """Write any pending document-index change now; Chroma persists chunks as they are added"""
+        if self._docs_index_save is not None and not self._docs_index_save.done():
+            self._docs_index_save.cancel()
+        await self._save_docs_index()
+    
+    async def clear(self):
+        """Remove every chunk by dropping and recreating the collection"""
+        try:
+            if not self.client:
+                raise Exception("Vector store not initialized")
+            
+            await asyncio.to_thread(self.client.delete_collection, self.collection_name)
+            self.collection = await asyncio.to_thread(
+                self.client.create_collection,
+                name=self.collection_name,
+                metadata=self.collection_metadata
+            )
+            self.documents = {}
+            # An empty collection's index is complete, no rebuild needed
+            self._docs_index_ready = True
+            self._schedule_docs_index_save()
+            print("Cleared vector store collection")
+            
+        except Exception as e:
+            raise Exception(f"Failed to clear vector store: {str(e)}")